@@ -15,26 +15,50 @@ Test data format: a tuple of test cases.
         - the path of the entry starting at test root
         - content of the entry (ignored for directories)
         - an optional fifth item with an age delta in hours for this file
+    - the expected summary values (see DH_OUTPUT_KEYS),
+    - optionally, a tuple of the answer to dh's question and the paths of
+      entries to delete before answering; dh then runs on a terminal, as it
+      asks only there
 
-Each test creates the test root directory and sets up the a-priori structure.
-Then it runs dh over the directory. Finally, it compares the content of the
-directory with the expected files.
+At import, the tuples are converted into TestCase and Entry named tuples.
+
+Each test creates its own directory below the test root and sets up the
+a-priori structure. Then it runs dh over the directory. Finally, it compares
+the content of the directory with the expected files. Independent test cases
+run concurrently in a pool of worker processes.
 """
 
 # pylint: disable=line-too-long
 
 import argparse
-import datetime
+import collections
+import concurrent.futures
+import functools
+import hashlib
 import os
 import subprocess
 import re
+import shutil
 import sys
 import tempfile
+import time
 
 if sys.version_info[0] < 3 or sys.version_info[1] < 5:
     print('Need python 3.5 or up.', file=sys.stderr)
     sys.exit(1)
 
+
+@functools.lru_cache(maxsize=None)
+def md5hex(content):
+    """ Return the md5 hex digest of a test payload, as it would appear in a
+    checksum file. """
+    return hashlib.md5(content.encode('utf8')).hexdigest()
+
+
+FOO_MD5 = md5hex('foo\n')
+# content of the size at which dh starts to memory-map files
+BIG_CONTENT = 'x' * 16 * 1048576
+
 DH_OUTPUT_KEYS = [
         '  processed',
         '  with no checksum file',
@@ -47,6 +71,11 @@ DH_OUTPUT_KEYS = [
         '  hashed bytes',
         ]
 
+# matches a summary line of any of the above keys, capturing key and value
+SUMMARY_RE = re.compile(
+    '^(' + '|'.join(re.escape(key) for key in DH_OUTPUT_KEYS) +
+    ') *: *([0-9]+)( .*)?$', re.MULTILINE)
+
 TEST_DATA = (
     (
         [], 0, "empty directory", (),
@@ -73,7 +102,14 @@ TEST_DATA = (
     (
         [], 0, "simple check with correct checksum and depth=1", (
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
+        ),
+        (1, None, 1, None, None, 1, 1, 0, 4,)
+    ),
+    (
+        [], 0, "simple check with correct upper case checksum", (
+            (True, True, 'foo.txt', 'foo\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5.upper()} *foo.txt\n'),
         ),
         (1, None, 1, None, None, 1, 1, 0, 4,)
     ),
@@ -82,7 +118,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/subsubdir/', None),
             (True, True, 'subdir/subsubdir/foo.txt', 'foo\n'),
-            (True, True, 'subdir/subsubdir/Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (True, True, 'subdir/subsubdir/Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 1, None, None, 1, 1, 0, 4,)
     ),
@@ -96,7 +132,7 @@ TEST_DATA = (
     (
         ['-c'], 0, "simple creation with one file", (
             (True, True, 'foo.txt', 'foo\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, None, None, None, 1, None, None, 4,)
     ),
@@ -104,7 +140,7 @@ TEST_DATA = (
         ['-u'], 0, "simple update with one file without checksum file and one ignored dotfile", (
             (True, True, '.foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 0, None, 1, 1, None, None, 4,)
     ),
@@ -112,7 +148,7 @@ TEST_DATA = (
         ['-a', '-u'], 0, "simple update with one file without checksum file and one ignored dotfile", (
             (True, True, '.foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *.foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *.foo.txt\n{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 0, None, 2, 2, None, None, 8,)
     ),
@@ -128,7 +164,7 @@ TEST_DATA = (
         ['-u'], 0, "simple update with one file newer than checksum file", (
             (True, True, 'foo.txt', 'foo\n', +1),
             (True, False, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 1, None, None, 1, None, None, 4)
     ),
@@ -138,7 +174,7 @@ TEST_DATA = (
         ['-u'], 2, "update with one file and two checksum entries", (
             (True, True, 'foo.txt', 'foo\n', +1),
             (True, False, 'Checksums.md5', 'ffffffffffffffffffffffffffffffff *foo.txt\naaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *bar.txt\n'),
-            (False, True, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *bar.txt\nd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *bar.txt\n{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 1, 1, None, 1, None, None, 4,)
     ),
@@ -147,7 +183,7 @@ TEST_DATA = (
         ['-u', '-d'], 0, "update with one file, two checksum entries and deletion of unreferenced entry", (
             (True, True, 'foo.txt', 'foo\n', +1),
             (True, False, 'Checksums.md5', 'ffffffffffffffffffffffffffffffff *foo.txt\naaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *bar.txt\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 1, 1, None, 1, None, None, 4,)
     ),
@@ -157,7 +193,7 @@ TEST_DATA = (
             (True, True, 'ignored.txt', ''),
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
-            (False, True, 'subdir/Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'subdir/Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, None, None, None, 1, None, None, 4,)
     ),
@@ -166,8 +202,8 @@ TEST_DATA = (
             (True, True, 'root.txt', 'foo\n'),
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
-            (False, True, 'subdir/Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *root.txt\n'),
+            (False, True, 'subdir/Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *root.txt\n'),
         ),
         (2, None, None, None, None, 2, None, None, 8,)
     ),
@@ -176,7 +212,7 @@ TEST_DATA = (
         ['-u', '-F', 'test.md5'], 0, "simple update with different checksum file name", (
             (True, True, 'foo.txt', 'foo\n'),
             (True, True, 'bar.txt', 'foo\n'),
-            (False, True, 'test.md5', 'd3b07384d113edec49eaa6238ad5ff00 *bar.txt\nd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'test.md5', f'{FOO_MD5} *bar.txt\n{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 0, None, 2, 2, None, None, 8,)
     ),
@@ -184,16 +220,25 @@ TEST_DATA = (
         ['-u', '-F', 'all'], 0, "simple update with individual checksum files", (
             (True, True, 'foo.txt', 'foo\n'),
             (True, True, 'bar.txt', 'foo\n'),
-            (False, True, 'foo.txt.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
-            (False, True, 'bar.txt.md5', 'd3b07384d113edec49eaa6238ad5ff00 *bar.txt\n'),
+            (False, True, 'foo.txt.md5', f'{FOO_MD5} *foo.txt\n'),
+            (False, True, 'bar.txt.md5', f'{FOO_MD5} *bar.txt\n'),
         ),
         (1, None, 0, None, 2, 2, None, None, 8,)
     ),
+    (
+        ['-c', '-F', 'all'], 0, "simple creation with individual checksum files", (
+            (True, True, 'foo.txt', 'foo\n'),
+            (True, True, 'bar.txt', 'foo\n'),
+            (False, True, 'foo.txt.md5', f'{FOO_MD5} *foo.txt\n'),
+            (False, True, 'bar.txt.md5', f'{FOO_MD5} *bar.txt\n'),
+        ),
+        (1, None, None, None, None, 2, None, None, 8,)
+    ),
     (
         ['-u', '-F', 'test.md5'], 0, "simple update with different checksum file name", (
             (True, True, 'foo.txt', 'foo\n'),
             (True, True, 'bar.txt', 'foo\n'),
-            (False, True, 'test.md5', 'd3b07384d113edec49eaa6238ad5ff00 *bar.txt\nd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (False, True, 'test.md5', f'{FOO_MD5} *bar.txt\n{FOO_MD5} *foo.txt\n'),
         ),
         (1, None, 0, None, 2, 2, None, None, 8,)
     ),
@@ -204,7 +249,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, 1, 2, None, None, 2, 2, 0, 8,)
     ),
@@ -214,7 +259,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, 1, 2, None, None, 2, 2, 0, 8,)
     ),
@@ -224,7 +269,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
         ),
         (2, 1, 1, None, None, 1, 1, 0, 4,)
     ),
@@ -234,7 +279,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 2, None, None, 2, 2, 0, 8,)
     ),
@@ -242,7 +287,7 @@ TEST_DATA = (
         ['-s'], 2, "check in subdir mode with missing file", (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 1, 1, None, 1, 1, 0, 4,)
     ),
@@ -250,8 +295,8 @@ TEST_DATA = (
         ['-u', '-s', '-d'], 0, "update in subdir mode with missing file and deletion", (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
-            (True, False, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, False, 'Checksums.md5', f'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 1, 1, None, 1, None, None, 4,)
     ),
@@ -260,7 +305,7 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (True, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (True, True, 'Checksums.md5', f'{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 1, None, 1, 1, 1, 0, 4,)
     ),
@@ -270,17 +315,27 @@ TEST_DATA = (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, None, None, None, 2, None, None, 8,)
     ),
+    (
+        ['-c', '-s'], 0, "create in subdir mode with nested subdirs", (
+            (True, True, 'subdir/', None),
+            (True, True, 'subdir/nested/', None),
+            (True, True, 'subdir/nested/foo.txt', 'foo\n'),
+            (True, True, 'foo.txt', 'foo\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/nested/foo.txt\n'),
+        ),
+        (3, None, None, None, None, 2, None, None, 8,)
+    ),
     (
         ['-u', '-s'], 0, "update in subdir mode with incorrect checksum, but old timestamp", (
             (True, True, 'subdir/', None),
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
             (True, False, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\n', -1),
-            (False, True, 'Checksums.md5', 'd3b07384d113edec49eaa6238ad5ff00 *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 1, None, 1, 2, None, None, 8,)
     ),
@@ -290,22 +345,100 @@ TEST_DATA = (
             (True, True, 'subdir/foo.txt', 'foo\n'),
             (True, True, 'foo.txt', 'foo\n'),
             (True, False, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\n', +1),
-            (False, True, 'Checksums.md5', 'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\nd3b07384d113edec49eaa6238ad5ff00 *subdir/foo.txt\n'),
+            (False, True, 'Checksums.md5', f'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *foo.txt\n{FOO_MD5} *subdir/foo.txt\n'),
         ),
         (2, None, 1, None, 1, 1, None, None, 4,)
     ),
+    (
+        ['-j', '2'], 2, "check with two files hashed concurrently, one of them with wrong checksum", (
+            (True, True, 'bar.txt', 'foo\n'),
+            (True, True, 'foo.txt', 'foo\n'),
+            (True, True, 'Checksums.md5', f'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *bar.txt\n{FOO_MD5} *foo.txt\n'),
+        ),
+        (1, None, 2, None, None, 2, 1, 1, 8,)
+    ),
+    (
+        ['-j', '2'], 2, "check with files hashed concurrently, with wrong checksums and missing files in between", (
+            (True, True, 'a.txt', 'foo\n'),
+            (True, True, 'c.txt', 'foo\n'),
+            (True, True, 'e.txt', 'foo\n'),
+            (True, True, 'Checksums.md5', f'aaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *a.txt\n{FOO_MD5} *b.txt\n{FOO_MD5} *c.txt\naaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *d.txt\naaaaaaaaaaaaaaaaaaaaaaaaaaaaaaaa *e.txt\n'),
+        ),
+        (1, None, 3, 2, None, 3, 1, 2, 12,)
+    ),
+    (
+        ['-c', '-j', '2'], 0, "creation with two files hashed concurrently", (
+            (True, True, 'bar.txt', 'foo\n'),
+            (True, True, 'foo.txt', 'foo\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *bar.txt\n{FOO_MD5} *foo.txt\n'),
+        ),
+        (1, None, None, None, None, 2, None, None, 8,)
+    ),
+    (
+        [], 0, "check of a file big enough to be memory-mapped", (
+            (True, True, 'big.bin', BIG_CONTENT),
+            (True, True, 'Checksums.md5', f'{md5hex(BIG_CONTENT)} *big.bin\n'),
+        ),
+        (1, None, 1, None, None, 1, 1, 0, len(BIG_CONTENT),)
+    ),
+    (
+        ['-c'], 2, "creation with a file deleted after listing, before hashing", (
+            (True, False, 'bar.txt', 'foo\n'),
+            (True, True, 'foo.txt', 'foo\n'),
+            (True, False, 'Checksums.md5', f'{FOO_MD5} *bar.txt\n{FOO_MD5} *foo.txt\n'),
+            (False, True, 'Checksums.md5', f'{FOO_MD5} *foo.txt\n'),
+        ),
+        (1, None, None, None, None, 1, None, None, 4,),
+        ('o', ('bar.txt',))
+    ),
     # todo:
     #   --skip und --limit, also with subdir mode
     #   create with and without --overwrite
     #   --ignore-subdir-checksums
 )
 
+DH_PATH = os.getcwd() + os.path.sep + 'dh'
+# one hour in nanoseconds, the unit of entry ages for os.utime
+HOUR_NS = 3600 * 1000000000
+# the fixed part of the dh command line for every test case
+DH_COMMAND = (DH_PATH, '-qqq', '--no-color')
+
+TestCase = collections.namedtuple(
+    'TestCase',
+    ('command', 'exit_code', 'comment', 'entries', 'summary', 'expected',
+     'prompt'))
+Entry = collections.namedtuple(
+    'Entry', ('before', 'after', 'path', 'content', 'age'), defaults=(None,))
+
+
+def make_test_case(args, exit_code, comment, entries, summary, prompt=None):
+    """ Convert a test case tuple from TEST_DATA into a TestCase.
+
+    :return: the TestCase, with its full dh command line and expected
+             directory content precomputed
+    """
+
+    # paths recur across test cases, so share one string object for each;
+    # contents are stored as bytes, ready to be written and compared
+    entries = tuple(
+        Entry(before, after, sys.intern(path),
+              None if content is None else content.encode('utf8'), *age)
+        for before, after, path, content, *age in entries)
+    # dictionary mapping filename to file content after the dh run
+    expected = {entry.path: entry.content for entry in entries if entry.after}
+    # the complete dh command line, ready to be passed to subprocess
+    command = DH_COMMAND + tuple(args)
+    return TestCase(
+        command, exit_code, comment, entries, summary, expected, prompt)
+
+
+TEST_DATA = tuple(make_test_case(*test_case) for test_case in TEST_DATA)
+
 PASSED = 0
 FAILED = 0
 
-TEST_ROOT = tempfile.mkdtemp(prefix='dhtest-') + os.path.sep
-DH_PATH = os.getcwd() + os.path.sep + 'dh'
-os.chdir(TEST_ROOT)
+# marker for an entry that is not expected (None is the content of dirs)
+MISSING = object()
 
 
 def parse_arguments(test_count):
@@ -352,22 +485,35 @@ def parse_arguments(test_count):
     return (args.output, args.wait, result)
 
 
-def get_dirlist(prefix, output):
+def walk_dir(root):
     """
-    Get a recursive list of files and directories.
+    Walk a directory tree depth-first, using a work list instead of recursion.
 
-    :param str prefix: the directory to look at
-    :param list output: the list in which to write the result recursively
-    :return: the result as a flat list: ['subdir/', 'subdir/file', 'file']
+    :param str root: the test case directory, ending with a path separator
+    :return: a generator of tuples (path, is_dir) with paths based on root:
+             ('subdir/', True), ('file', False), ('subdir/file', False)
     """
 
-    dirlist = os.listdir(prefix if prefix else '.')
-    for entry in dirlist:
-        if os.path.isdir(prefix + entry):
-            output.append(prefix + entry + os.path.sep)
-            get_dirlist(output[-1], output)
-        else:
-            output.append(prefix + entry)
+    # local names for lookups done for every entry
+    scandir = os.scandir
+    sep = os.path.sep
+
+    pending = collections.deque([''])
+    while pending:
+        prefix = pending.pop()
+        # read the whole listing first, so the directory handle is closed
+        # while the caller works on the entries
+        with scandir(root + prefix) as dirlist:
+            entries = [
+                (entry.name, entry.is_dir(follow_symlinks=False))
+                for entry in dirlist]
+        for name, is_dir in entries:
+            if is_dir:
+                path = prefix + name + sep
+                pending.append(path)
+                yield path, True
+            else:
+                yield prefix + name, False
 
 
 def testing(width, number, text):
@@ -404,36 +550,75 @@ def passed(output, stdout):
         print(stdout)
 
 
-def clean_up(path):
-    """ Delete all test data. """
-    for entry in os.listdir(path):
-        if os.path.isdir(path + entry):
-            clean_up(path + entry + os.path.sep)
-            os.rmdir(path + entry)
-        else:
-            os.unlink(path + entry)
-
-
-def set_up_dirs(test_case):
+def set_up_dirs(test_case, root):
     """ Create the file tree specific to a test case.
 
     :param test_case: tuple with test data (see definition of TEST_CASE)
+    :param str root: the test case directory, ending with a path separator
     """
 
-    _, _, _, entries, _ = test_case
-    for entry in entries:
-        before, _, filename, content = entry[:4]
-        if not before:
+    # one reference time for all aged entries of the test case
+    now = time.time_ns()
+    for entry in test_case.entries:
+        if not entry.before:
             continue
-        if filename.endswith('/'):
-            os.mkdir(filename)
+        path = root + entry.path
+        if entry.path.endswith('/'):
+            os.makedirs(path, exist_ok=True)
         else:
-            with open(filename, 'w', encoding='utf8') as file:
-                file.write(content)
-        if len(entry) == 5:
-            newtime = datetime.datetime.timestamp(datetime.datetime.now())
-            newtime = int((newtime + entry[4] * 3600) * 1000000000)
-            os.utime(filename, ns=(newtime, newtime))
+            # the payloads are tiny, so bypass Python's buffered file objects
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, entry.content)
+            finally:
+                os.close(fd)
+        if entry.age is not None:
+            newtime = now + entry.age * HOUR_NS
+            os.utime(path, ns=(newtime, newtime))
+
+
+def run_on_terminal(command, root, prompt):
+    """ Run dh on a pseudo terminal and answer its question.
+
+    When dh asks, it has listed the directories already, but not yet hashed
+    anything. So deleting entries before answering is like deleting them
+    while dh runs.
+
+    :param tuple command: the complete dh command line
+    :param str root: the test case directory, ending with a path separator
+    :param tuple prompt: the answer and the paths of the entries to delete
+    :return: tuple (exit code of dh, output of dh)
+    """
+
+    answer, to_delete = prompt
+    master, slave = os.openpty()
+    try:
+        with subprocess.Popen(
+                command, cwd=root, stdin=slave, stdout=slave, stderr=slave) \
+                as process:
+            os.close(slave)
+            slave = None
+            output = b''
+            while True:
+                try:
+                    data = os.read(master, 4096)
+                except OSError:
+                    # EIO: dh exited and closed the terminal
+                    break
+                if not data:
+                    break
+                output += data
+                if answer is not None and output.endswith(b'? '):
+                    for path in to_delete:
+                        os.remove(root + path)
+                    os.write(master, answer.encode('utf8') + b'\n')
+                    answer = None
+    finally:
+        os.close(master)
+        if slave is not None:
+            os.close(slave)
+    # the terminal ends lines with \r\n
+    return process.returncode, output.decode('utf8').replace('\r\n', '\n')
 
 
 def check_summary(dh_output, expected):
@@ -446,14 +631,8 @@ def check_summary(dh_output, expected):
     result = {key: None for key in DH_OUTPUT_KEYS}
     errorlist = []
 
-    for line in dh_output.split('\n'):
-        # remove colour control sequences
-        line = re.sub(r'\033\[[01];[0-9]+m', '', line)
-
-        for pattern in DH_OUTPUT_KEYS:
-            rem = re.match(f'^{pattern} *: *([0-9]+)( .*)?$', line)
-            if rem:
-                result[pattern] = int(rem.group(1))
+    for rem in SUMMARY_RE.finditer(dh_output):
+        result[rem.group(1)] = int(rem.group(2))
 
     for key, exp in zip(DH_OUTPUT_KEYS, expected, strict=True):
         if result[key] != exp:
@@ -462,58 +641,111 @@ def check_summary(dh_output, expected):
     return errorlist
 
 
-def do_test_case(test_case, output, wait):
+def do_test_case(test_case, root, wait):
     """ Perform all actions pertaining to a single test case.
 
     :param test_case: tuple with test data (see definition of TEST_CASE)
+    :param str root: the test case directory, ending with a path separator
+    :param bool wait: whether to wait for user confirmation before running dh
+    :return: tuple (reason of failure or None if passed, whether to show the
+             output of dh regardless of option -o, output of dh)
     """
 
-    args, exit_code, _, entries, summary = test_case
+    command, exit_code, _, _, summary, expected, prompt = test_case
 
     if wait:
-        input(f"\nWaiting to run {' '.join([DH_PATH, '-qqq'] + args)} ...")
-
-    # when: run dh on the test data
-    completed = subprocess.run(
-        [DH_PATH, '-qqq'] + args,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-        check=False, text=True)
+        input(f"\nWaiting to run {' '.join(command)} in {root} ...")
+
+    # when: run dh on the test data (without colours, so the summary needs
+    # no cleaning before parsing it); descriptors are non-inheritable by
+    # default anyway, so the child need not try to close them all
+    if prompt is None:
+        completed = subprocess.run(
+            command, cwd=root,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            close_fds=False, check=False, text=True)
+    else:
+        completed = subprocess.CompletedProcess(
+            command, *run_on_terminal(command, root, prompt))
 
     # then: gather the result and compare with expected content
     if exit_code != completed.returncode:
-        failed(f'exit code. Expected={exit_code}, Actual={completed.returncode}',
-               output, completed.stdout)
-        return False
+        return (f'exit code. Expected={exit_code}, Actual={completed.returncode}',
+                False, completed.stdout)
 
     result = check_summary(completed.stdout, summary)
     if result:
-        failed('summary\n' + '\n'.join(result) + '\n', True, completed.stdout)
-        return False
+        return ('summary\n' + '\n'.join(result) + '\n', True, completed.stdout)
+
+    # compare the result with the expected data in a single walk; every found
+    # entry is removed from (a copy of) expected, so in the end only missing
+    # ones remain
+    expected = dict(expected)
+    unexpected = []
+    wrong_content = None
+    for filename, is_dir in walk_dir(root):
+        content = expected.pop(filename, MISSING)
+        if content is MISSING:
+            unexpected.append(filename)
+            continue
+        if is_dir or wrong_content:
+            continue
+        # a differing size needs no reading to know that the content differs
+        if os.path.getsize(root + filename) != len(content):
+            wrong_content = filename
+            continue
+        with open(root + filename, 'rb') as file:
+            if file.read() != content:
+                wrong_content = filename
 
-    # dictionary mapping filename to file content
-    expected = {entry[2]: entry[3] for entry in entries if entry[1]}
+    if unexpected or expected:
+        # only on failure, assemble which entries are off
+        differences = [f'unexpected {filename}' for filename in unexpected]
+        differences.extend(f'missing {filename}' for filename in sorted(expected))
+        return ('directory content (' + ', '.join(differences) + ')',
+                False, completed.stdout)
 
-    result = []
-    get_dirlist('', result)
+    if wrong_content:
+        return (f'content of file {wrong_content}', False, completed.stdout)
+
+    return (None, False, completed.stdout)
+
+
+def run_test_case(job):
+    """ Set up, run and clean up a single test case in its own directory.
+
+    This runs in a worker process, so it must not touch global state.
 
-    # compare the result with the expected data
-    if set(expected.keys()) != set(result):
-        failed('directory content', output, completed.stdout)
-        return False
+    :param tuple job: (test number, TestCase, test root, whether to wait)
+    :return: the result of do_test_case
+    """
+
+    number, test_case, test_root, wait = job
+    root = test_root + str(number) + os.path.sep
+    os.mkdir(root)
+    # given
+    set_up_dirs(test_case, root)
+    # when and then
+    result = do_test_case(test_case, root, wait)
+    if wait:
+        input('Waiting to clean up ...')
+    shutil.rmtree(root)
+    return result
+
+
+def make_test_root():
+    """ Create the directory for all test data, preferably in memory.
 
-    # check file content
-    result.reverse()
-    for filename in result:
-        if not filename.endswith(os.path.sep):
-            with open(filename, encoding='utf8') as file:
-                content = file.read()
-                if content != expected[filename]:
-                    failed(f'content of file {filename}',
-                           output, completed.stdout)
-                    return False
+    :return: the path of the directory, ending with a path separator
+    """
 
-    passed(output, completed.stdout)
-    return True
+    # the test data is small and short-lived, so keep it off the disk
+    if os.path.isdir('/dev/shm'):
+        try:
+            return tempfile.mkdtemp(prefix='dhtest-', dir='/dev/shm') + os.path.sep
+        except OSError:
+            pass
+    return tempfile.mkdtemp(prefix='dhtest-') + os.path.sep
 
 
 def main():
@@ -522,28 +754,30 @@ def main():
     columns = len(str(test_count))
     do_output, do_wait, case_range = parse_arguments(test_count)
 
-    test_number = 0
-    tests_run = 0
-
+    test_root = make_test_root()
     if do_wait:
-        print(f"Test directory is '{TEST_ROOT}'")
-
-    for test_data_item in TEST_DATA:
-        test_number += 1
-        if test_number not in case_range:
-            continue
-
-        testing(columns, test_number, test_data_item[2])
-        # given
-        set_up_dirs(test_data_item)
-        # when and then
-        do_test_case(test_data_item, do_output, do_wait)
-        if do_wait:
-            input('Waiting to clean up ...')
-        clean_up(TEST_ROOT)
-        tests_run += 1
-
-    os.rmdir(TEST_ROOT)
+        print(f"Test directory is '{test_root}'")
+
+    jobs = [
+        (test_number, test_data_item, test_root, do_wait)
+        for test_number, test_data_item in enumerate(TEST_DATA, 1)
+        if test_number in case_range]
+
+    # the executor starts worker processes only once work is submitted, and
+    # waiting for the user only works one test case after the other
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        results = map(run_test_case, jobs) if do_wait \
+            else executor.map(run_test_case, jobs)
+        for test_number, test_data_item, _, _ in jobs:
+            testing(columns, test_number, test_data_item.comment)
+            reason, force_output, stdout = next(results)
+            if reason is None:
+                passed(do_output, stdout)
+            else:
+                failed(reason, do_output or force_output, stdout)
+    tests_run = len(jobs)
+
+    os.rmdir(test_root)
 
     print()
     print('Failed test cases:', coloured('31', FAILED, FAILED != 0))